@@ -0,0 +1,77 @@
+"""
+Numerical kernels for the hot paths of the refinement iteration.
+
+If Numba is available the kernels are JIT-compiled; otherwise equivalent pure
+NumPy implementations are used.
+"""
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _mad_inlier_numpy(y, pred, wbool, lb, ub):
+    """Fused MAD-based inlier classification.
+
+    Compute the median absolute residual ``rmad`` of y against pred over the
+    points selected by the boolean mask wbool, then classify every point by
+    whether its residual in units of rmad lies within [lb, ub].
+
+    Return the boolean inlier array and rmad.
+    """
+    residuals = y - pred
+    rmad = np.median(np.abs(residuals[wbool]))
+    deviations = residuals / rmad
+    return (lb <= deviations) & (deviations <= ub), rmad
+
+
+if njit is None:
+    mad_inlier = _mad_inlier_numpy
+else:
+    # The bounds are runtime arguments on purpose: a kernel specialized to
+    # fixed bounds would have to be a closure, which Numba cannot cache to
+    # disk, so every process would pay for compiling it again.
+    @njit(cache=True, error_model="numpy")
+    def mad_inlier(y, pred, wbool, lb, ub):
+        """JIT-compiled counterpart of _mad_inlier_numpy().
+
+        Not compiled with parallel=True: Numba's threading layer is not safe
+        to fork, and knot_shift_aggregate() may fork worker processes.
+        """
+        n = y.size
+        # Compact the absolute residuals of the inliers into one buffer.
+        abs_res = np.empty(np.count_nonzero(wbool))
+        j = 0
+        for i in range(n):
+            if wbool[i]:
+                abs_res[j] = abs(y[i] - pred[i])
+                j += 1
+        rmad = np.median(abs_res)
+        out = np.empty(n, dtype=np.bool_)
+        for i in range(n):
+            dev = (y[i] - pred[i]) / rmad
+            out[i] = (lb <= dev) and (dev <= ub)
+        return out, rmad
+
+
+def _hamming_gt_numpy(a, b, thresh):
+    """Hamming distance between two equal-length uint8 arrays of zeros and
+    ones. The compiled version may stop counting as soon as the distance
+    exceeds thresh, in which case the returned count is only a lower bound.
+    """
+    return int(np.count_nonzero(a != b))
+
+
+if njit is None:
+    hamming_gt = _hamming_gt_numpy
+else:
+    @njit(cache=True)
+    def hamming_gt(a, b, thresh):
+        """JIT-compiled, early-exit counterpart of _hamming_gt_numpy()."""
+        c = 0
+        for i in range(a.size):
+            c += a[i] ^ b[i]
+            if c > thresh:
+                return c
+        return c
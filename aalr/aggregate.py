@@ -1,13 +1,33 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
-from .spline_model import SplineModel
+
+
+def _fit_shifted(model, knots, refine_args):
+    """Fit and refine a copy of model with the given knots, returning its
+    mask.
+    """
+    m = model.with_knots(knots)
+    m.refine(**refine_args)
+    return m._wb
 
 
 def knot_shift_aggregate(model,
                          duplicates: int = 3, proximity_factor: float = 0.001,
-                         **refine_args):
+                         max_workers=None, **refine_args):
     """Create an aggregate model on the input model by duplicating knots with
     shift. In total, (2 * duplicates) copies are made (on the left and right
     sides).
+
+    All models involved, including the returned aggregate, are derived from
+    the input model by its with_knots() method. They are therefore of the
+    same class as the input model and use its overridden methods (such as
+    inlier_predicate), if any.
+
+    If ``max_workers`` is greater than 1, the shifted copies are fitted in
+    parallel in a pool of that many processes. Otherwise (the default) they
+    are fitted one after another in the calling process. The result is the
+    same either way.
     """
     d = int(duplicates)
     assert d > 0
@@ -16,27 +36,21 @@ def knot_shift_aggregate(model,
     q = (1.0 - p) / d
     scale_left = (model.knots[0] - model.t[0]) * q
     scale_right = (model.t[-1] - model.knots[-1]) * q
-    shifted_models = []
-    for i in range(-d, 0):
-        this_model = SplineModel(model.t, model.y,
-                                 knots_override=(model.knots +
-                                                 i * scale_left),
-                                 **model._kwargs_save)
-        this_model.refine(**refine_args)
-        shifted_models.append(this_model)
-    for i in range(1, d + 1):
-        this_model = SplineModel(model.t, model.y,
-                                 knots_override=(model.knots +
-                                                 i * scale_right),
-                                 **model._kwargs_save)
-        this_model.refine(**refine_args)
-        shifted_models.append(this_model)
-    w = model.w.copy()
-    for m in shifted_models:
-        w *= m.w
-    model_new = SplineModel(model.t, model.y, w=w,
-                            knots_override=model.knots,
-                            **model._kwargs_save)
+    # All shifted knot arrays at once, one per row.
+    shifts = np.r_[np.arange(-d, 0) * scale_left,
+                   np.arange(1, d + 1) * scale_right]
+    shifted_knots = model.knots[np.newaxis, :] + shifts[:, np.newaxis]
+    n = len(shifted_knots)
+    if max_workers is not None and max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            ws = list(ex.map(_fit_shifted, repeat(model, n), shifted_knots,
+                             repeat(refine_args, n)))
+    else:
+        ws = [_fit_shifted(model, knots, refine_args)
+              for knots in shifted_knots]
+    all_w = np.stack([model._wb] + ws, axis=0)
+    w = np.logical_and.reduce(all_w, axis=0)
+    model_new = model.with_knots(model.knots, w=w)
     model_agg = model_new.cure_knots()
     model_agg.refine(**refine_args)
     return model_agg
@@ -2,9 +2,56 @@
 Implementation for the underlying regressor/smoother based on cubic splines.
 """
 from collections import namedtuple
+import copy
 import numpy as np
-from scipy.interpolate import LSQUnivariateSpline
+from scipy.interpolate import BSpline, LSQUnivariateSpline
+from scipy.linalg import LinAlgError, solveh_banded
 from .util import dist, mask_index
+from ._kernels import hamming_gt, mad_inlier
+
+
+# Extrapolation modes accepted by LSQUnivariateSpline's ``ext`` parameter.
+_EXT_MODES = {"extrapolate": 0, "zeros": 1, "raise": 2, "const": 3}
+
+
+class _BandedSpline:
+    """
+    Minimal stand-in for LSQUnivariateSpline holding the solution of a masked
+    refit (see SplineModel._refit_masked). It supports evaluation with the
+    same ``ext`` modes, and the get_knots(), get_coeffs() and get_residual()
+    accessors.
+    """
+    def __init__(self, tfull, coef, k, ext, residual):
+        self._bspl = BSpline(tfull, coef, k, extrapolate=True)
+        self._k = k
+        self.ext = _EXT_MODES.get(ext, ext)
+        self._residual = residual
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=float)
+        tfull = self._bspl.t
+        xb, xe = tfull[0], tfull[-1]
+        outside = (x < xb) | (x > xe)
+        if self.ext == 2 and np.any(outside):
+            raise ValueError("x value is out of bounds")
+        if self.ext == 3:
+            x = np.clip(x, xb, xe)
+        res = self._bspl(x)
+        if self.ext == 1:
+            res = np.where(outside, 0.0, res)
+        return res
+
+    def get_knots(self):
+        """Return the interior knots and the two end-points."""
+        return self._bspl.t[self._k:len(self._bspl.t) - self._k]
+
+    def get_coeffs(self):
+        """Return the B-spline coefficients."""
+        return self._bspl.c
+
+    def get_residual(self):
+        """Return the weighted sum of squared residuals of the fit."""
+        return self._residual
 
 
 class SplineModel:
@@ -26,7 +73,16 @@ class SplineModel:
 
         self_pred: Predicted values at the time frames as specified by ``t``.
 
-        _spr: Underlying LSQUnivariateSpline instance.
+        _spr: Underlying LSQUnivariateSpline instance. After a refit of the
+              mask on the cached design matrix it is a _BandedSpline instead,
+              which supports evaluation and the get_knots(), get_coeffs() and
+              get_residual() accessors only.
+
+        _design: Cached triple of the knots it was built for, the full knot
+                 vector and the sparse B-spline design matrix at t, built on
+                 the first refit of the mask.
+
+        _wb: Window values as a boolean array, from which w is derived.
     """
     def __init__(self, t, y, nknots: int = 23, knots_override=None, w=None,
                  **spline_args):
@@ -81,6 +137,8 @@ class SplineModel:
             winit = np.asarray(w, dtype=float)
         self.y = np.asarray(y, dtype=float)
         self.t = np.asarray(t, dtype=float)
+        self._spr = None
+        self._design = None
         self.replace_mask(winit)
 
     def replace_mask(self, w):
@@ -89,13 +147,85 @@ class SplineModel:
         """
         assert np.shape(w) == np.shape(self.t)
         assert len(w) == len(self.t)
-        self.w = np.asarray(w, dtype=float)
-        self._spr = LSQUnivariateSpline(self.t, self.y, self.knots, self.w,
-                                        **self._kwargs_save)
+        # The boolean mask is canonical; the float copy is only for SciPy.
+        self._wb = np.asarray(w, dtype=bool)
+        self.w = self._wb.view(np.uint8).astype(float)
+        spr = None
+        if self._spr is not None:
+            # Only the mask has changed since the last fit, so the design
+            # matrix for the current knots can be reused.
+            if (self._design is None or
+                    not np.array_equal(self._design[0], self.knots)):
+                self._design = self._build_design()
+            spr = self._refit_masked()
+        if spr is None:
+            spr = LSQUnivariateSpline(self.t, self.y, self.knots, self.w,
+                                      **self._kwargs_save)
+        self._spr = spr
         self.self_pred = self(self.t)
         # Flag indicating whether w has just been replaced.
         self._stats_dirty = True
 
+    def _build_design(self):
+        """Return a copy of the current knots, together with the full knot
+        vector and the B-spline design matrix at the time frames as used by
+        LSQUnivariateSpline for these knots.
+        """
+        k = self._kwargs_save["k"]
+        xb, xe = self._kwargs_save["bbox"]
+        xb = self.t[0] if xb is None else xb
+        xe = self.t[-1] if xe is None else xe
+        tfull = np.r_[[xb] * (k + 1), self.knots, [xe] * (k + 1)]
+        return (self.knots.copy(), tfull,
+                BSpline.design_matrix(self.t, tfull, k).tocsr())
+
+    def _refit_masked(self):
+        """Solve the masked least-squares problem by the banded normal
+        equations on the cached design matrix. Return the new spline, or None
+        if the system is singular (e.g. knots in masked-out intervals).
+
+        The result agrees with a fresh LSQUnivariateSpline fit, also after the
+        knots have been reassigned:
+
+        >>> t = np.linspace(0.0, 10.0, 200)
+        >>> y = np.sin(t) + np.cos(3.0 * t)
+        >>> w = np.arange(len(t)) % 7 != 0
+        >>> m = SplineModel(t, y, nknots=10)
+        >>> m.replace_mask(w)
+        >>> ref = LSQUnivariateSpline(t, y, m.knots, w, ext="const")
+        >>> bool(np.allclose(m(t), ref(t), rtol=0.0, atol=1e-9))
+        True
+        >>> bool(np.isclose(m._spr.get_residual(), ref.get_residual()))
+        True
+        >>> bool(np.allclose(m._spr.get_knots(), ref.get_knots()))
+        True
+        >>> bool(np.allclose(m._spr.get_coeffs(), ref.get_coeffs()))
+        True
+        >>> bool(np.allclose(m([-1.0, 11.0]), ref([-1.0, 11.0])))
+        True
+        >>> m.knots = m.knots + 0.1
+        >>> m.replace_mask(w)
+        >>> ref = LSQUnivariateSpline(t, y, m.knots, w, ext="const")
+        >>> bool(np.allclose(m(t), ref(t), rtol=0.0, atol=1e-9))
+        True
+        """
+        _, tfull, bmat = self._design
+        k = self._kwargs_save["k"]
+        bw = bmat[self._wb]
+        normal = (bw.T @ bw).tocsr()
+        ncoef = normal.shape[0]
+        # Lower banded storage of the symmetric normal matrix.
+        ab = np.zeros((k + 1, ncoef))
+        for j in range(k + 1):
+            ab[j, :ncoef - j] = normal.diagonal(-j)
+        try:
+            coef = solveh_banded(ab, bw.T @ self.y[self._wb], lower=True)
+        except LinAlgError:
+            return None
+        resid = self.y[self._wb] - bw @ coef
+        return _BandedSpline(tfull, coef, k, self._kwargs_save["ext"],
+                             float(resid @ resid))
+
     def inlier_predicate(self, t, y, ub: float = 4, lb: float = -10):
         """Return boolean value or array (same shape as that of t and y) for
         the input values at (t, y) based on the current instance.
@@ -112,16 +242,44 @@ class SplineModel:
         formalism where the inlier-outlier criterion can be implemented in a
         fairly versatile manner.
         """
+        if t is self.t and y is self.y:
+            # Fused evaluation of the statistics and the cut over the model's
+            # own data.
+            inliers, self.rmad = mad_inlier(self.y, self.self_pred, self._wb,
+                                            float(lb), float(ub))
+            self._stats_dirty = False
+            return inliers
         if self._stats_dirty:
             # Calculate the vital statistics
-            bm = np.asarray(self.w, dtype=bool)
+            bm = self._wb
             residuals = self.y[bm] - self.self_pred[bm]
-            self.rmad = np.nanmedian(np.abs(residuals))
+            self.rmad = np.median(np.abs(residuals))
             self._stats_dirty = False
-        preds = self(t)
+        # Predictions at the model's own time frames are already cached.
+        preds = self.self_pred if t is self.t else self(t)
         deviations = (y - preds) / self.rmad
         return (lb <= deviations) & (deviations <= ub)
 
+    def with_knots(self, knots, w=None):
+        """Return a new instance on the same data (shared, not copied) and
+        spline arguments, but with the internal knots replaced by ``knots``.
+
+        The new instance is of the same class as this one, so any overridden
+        methods (such as inlier_predicate) and subclass state carry over.
+
+        The new mask is w if given, otherwise filled with True.
+        """
+        # A shallow copy keeps any state set up by a subclass's __init__. It
+        # also inherits the fitted spline, so that even the first fit goes
+        # through the design matrix instead of FITPACK, and the cached design
+        # matrix, which replace_mask() rebuilds only if the knots differ.
+        new = copy.copy(self)
+        new.knots = np.asarray(knots, dtype=float)
+        if w is None:
+            w = np.ones(len(self.t), dtype=bool)
+        new.replace_mask(w)
+        return new
+
     def __call__(self, t):
         return self._spr(t)
 
@@ -157,7 +315,11 @@ class SplineModel:
         while niter <= maxiter:
             w_post_pred = self.inlier_predicate(self.t, self.y,
                                                 **predicate_args)
-            dxor = dist(w_post_pred, self.w)
+            w_post_pred = np.asarray(w_post_pred, dtype=bool)
+            w_prev = self._wb
+            # Exact if within target_d; otherwise possibly a partial count.
+            dxor = int(hamming_gt(w_post_pred.view(np.uint8),
+                                  w_prev.view(np.uint8), target_d))
             if dxor <= target_d:
                 result = FitResult(0, "Converged", niter, dxor)
                 break
@@ -165,25 +327,26 @@ class SplineModel:
             niter += 1
         else:
             result = FitResult(1, "Maximum iteration limit exceeded",
-                               niter, dxor)
+                               niter, dist(w_post_pred, w_prev))
         return result
 
     def cure_knots(self):
         """Return a new instance with the excessive knots in the masked-out
         intervals removed.
+
+        The new instance is created by with_knots(), so it is of the same class
+        as this one and refits with its overridden methods, if any.
         """
-        kt_new = []
-        midx = mask_index(self.w)
-        for knot in self.knots:
-            skip = False
-            for mi_lo, mi_hi in midx:
-                mloc_lo = self.t[mi_lo]
-                mloc_hi = self.t[mi_hi - 1]
-                if (mloc_lo < knot < mloc_hi):
-                    skip = True
-                    break
-            if not skip:
-                kt_new.append(knot)
-        return SplineModel(self.t, self.y,
-                           knots_override=kt_new, w=self.w,
-                           **self._kwargs_save)
+        midx = mask_index(self._wb)
+        # Range of knots lying strictly inside each masked-out interval.
+        lo_idx = np.searchsorted(self.knots, self.t[midx[:, 0]], side="right")
+        hi_idx = np.searchsorted(self.knots, self.t[midx[:, 1] - 1],
+                                 side="left")
+        nonempty = lo_idx < hi_idx
+        # Mark the ranges by accumulating +1/-1 at their boundaries.
+        boundaries = np.zeros(len(self.knots) + 1, dtype=int)
+        np.add.at(boundaries, lo_idx[nonempty], 1)
+        np.add.at(boundaries, hi_idx[nonempty], -1)
+        drop = np.cumsum(boundaries[:-1]) > 0
+        kt_new = self.knots[~drop]
+        return self.with_knots(kt_new, w=self._wb)
@@ -2,51 +2,41 @@ import numpy as np
 
 
 def mask_index(warray):
-    """Convert mask-array to a list of two-lists indicating the
-    slice ends for all of the consecutively masked-out (i.e. ones marked by
-    zero or False) indices.
+    """Convert mask-array to an integer array of shape (M, 2), each row of
+    which indicates the slice ends for a run of consecutively masked-out (i.e.
+    ones marked by zero or False) indices.
 
-    The output list may be empty if no such indices are found.
+    The output has zero rows if no such indices are found.
 
-    >>> mask_index([True, True, False, False, False, True, False, True])
+    >>> mask_index([True, True, False, False, False, True, False, True]
+    ...            ).tolist()
     [[2, 5], [6, 7]]
-    >>> mask_index([False, False, False])
+    >>> mask_index([False, False, False]).tolist()
     [[0, 3]]
-    >>> mask_index([True, True])
-    []
-    >>> mask_index([])
-    []
+    >>> mask_index([True, True]).shape
+    (0, 2)
+    >>> mask_index([]).shape
+    (0, 2)
 
-    This is implemented using a simple state machine that scans over the input
-    sequence.
+    This is implemented by edge detection on the input sequence: a falling
+    edge marks the start of a masked-out chunk and a rising edge marks its
+    (exclusive) end, with the chunks touching either end of the input handled
+    separately.
     """
-    # Overall container for all output chunks.
-    res = []
-    # Pad sentinel to the end of input.
-    stream = enumerate(np.asarray(np.concatenate((warray, [1])), dtype=bool))
-    # Container for the current chunk being found.
-    thisres = []
-    # A simple state machine: always seeking for a change ("edge") in the input
-    # stream.
-    state = "want_0"
-    for i, w in stream:
-        if w and (state == "want_0"):
-            continue
-        if w and (state == "want_1"):
-            state = "want_0"
-            thisres.append(i)
-            res.append(thisres)
-            thisres = []
-            continue
-        if (not w) and (state == "want_0"):
-            state = "want_1"
-            thisres.append(i)
-            continue
-        if (not w) and (state == "want_1"):
-            continue
-    return res
+    wb = np.asarray(warray, dtype=bool)
+    if wb.size == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    edges = np.diff(wb.view(np.int8))
+    starts = np.flatnonzero(edges == -1) + 1
+    ends = np.flatnonzero(edges == 1) + 1
+    if not wb[0]:
+        starts = np.r_[0, starts]
+    if not wb[-1]:
+        ends = np.r_[ends, wb.size]
+    return np.stack([starts, ends], axis=1).astype(np.int64)
 
 
 def dist(x, y) -> int:
     """Hamming distance between two equal-length sequences of bools."""
-    return np.sum(np.asarray(x, dtype=bool) ^ np.asarray(y, dtype=bool))
+    return int(np.count_nonzero(np.asarray(x, dtype=bool) !=
+                                np.asarray(y, dtype=bool)))